@@ -1,10 +1,12 @@
-import json
-import logging
-import os
-import random
-import requests
+import calendar
+import collections
+import re
+import secrets
+import subprocess
+import tempfile
+import threading
 import time
-import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
@@ -54,6 +56,7 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     VTKObservationMixin.__init__(self)  # needed for parameter node observation
     self.logic = None
     self._parameterNode = None
+    self._pnObserverTag = None
     self._updatingGUIFromParameterNode = False
 
   def setup(self):
@@ -85,6 +88,13 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.addObserver(slicer.mrmlScene, slicer.mrmlScene.StartCloseEvent, self.onSceneStartClose)
     self.addObserver(slicer.mrmlScene, slicer.mrmlScene.EndCloseEvent, self.onSceneEndClose)
 
+    # GUI changes are written to the parameter node once the GUI has been idle for 100ms,
+    # so that a burst of changes (such as dragging a slider) results in a single parameter node update.
+    self._pnUpdateTimer = qt.QTimer()
+    self._pnUpdateTimer.setSingleShot(True)
+    self._pnUpdateTimer.setInterval(100)
+    self._pnUpdateTimer.connect("timeout()", self._commitParameterNode)
+
     # These connections ensure that whenever user changes some settings on the GUI, that is saved in the MRML scene
     # (in the selected parameter node).
     self.ui.inputSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI)
@@ -103,7 +113,10 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     """
     Called when the application closes and the module widget is destroyed.
     """
+    self._flushParameterNodeUpdate()
+    self._removeParameterNodeObserver()
     self.removeObservers()
+    self.logic.shutdown()
 
   def enter(self):
     """
@@ -116,14 +129,17 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     """
     Called each time the user opens a different module.
     """
+    # Save pending GUI changes before the module is left
+    self._flushParameterNodeUpdate()
     # Do not react to parameter node changes (GUI wlil be updated when the user enters into the module)
-    self.removeObserver(self._parameterNode, vtk.vtkCommand.ModifiedEvent, self.updateGUIFromParameterNode)
+    self._removeParameterNodeObserver()
 
   def onSceneStartClose(self, caller, event):
     """
     Called just before the scene is closed.
     """
-    # Parameter node will be reset, do not use it anymore
+    # Save pending GUI changes, then do not use the parameter node anymore because it will be reset
+    self._flushParameterNodeUpdate()
     self.setParameterNode(None)
 
   def onSceneEndClose(self, caller, event):
@@ -143,11 +159,15 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     self.setParameterNode(self.logic.getParameterNode())
 
-    # Select default input nodes if nothing is selected yet to save a few clicks for the user
-    if not self._parameterNode.GetNodeReference("InputVolume"):
-      firstVolumeNode = slicer.mrmlScene.GetFirstNodeByClass("vtkMRMLScalarVolumeNode")
-      if firstVolumeNode:
-        self._parameterNode.SetNodeReferenceID("InputVolume", firstVolumeNode.GetID())
+    wasModified = self._parameterNode.StartModify()  # Modify all properties in a single batch
+    try:
+      # Select default input nodes if nothing is selected yet to save a few clicks for the user
+      if not self._parameterNode.GetNodeReference("InputVolume"):
+        firstVolumeNode = slicer.mrmlScene.GetFirstNodeByClass("vtkMRMLScalarVolumeNode")
+        if firstVolumeNode:
+          self._parameterNode.SetNodeReferenceID("InputVolume", firstVolumeNode.GetID())
+    finally:
+      self._parameterNode.EndModify(wasModified)
 
   def setParameterNode(self, inputParameterNode):
     """
@@ -155,21 +175,36 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     Observation is needed because when the parameter node is changed then the GUI must be updated immediately.
     """
 
+    # Nothing to do if this node is already set and observed
+    if inputParameterNode is self._parameterNode and self._pnObserverTag is not None:
+      return
+
     if inputParameterNode:
-      self.logic.setDefaultParameters(inputParameterNode)
+      wasModified = inputParameterNode.StartModify()  # Set all default values in a single batch
+      try:
+        self.logic.setDefaultParameters(inputParameterNode)
+      finally:
+        inputParameterNode.EndModify(wasModified)
 
     # Unobserve previously selected parameter node and add an observer to the newly selected.
     # Changes of parameter node are observed so that whenever parameters are changed by a script or any other module
     # those are reflected immediately in the GUI.
-    if self._parameterNode is not None:
-      self.removeObserver(self._parameterNode, vtk.vtkCommand.ModifiedEvent, self.updateGUIFromParameterNode)
+    self._removeParameterNodeObserver()
     self._parameterNode = inputParameterNode
     if self._parameterNode is not None:
-      self.addObserver(self._parameterNode, vtk.vtkCommand.ModifiedEvent, self.updateGUIFromParameterNode)
+      self._pnObserverTag = self._parameterNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.updateGUIFromParameterNode)
 
     # Initial GUI update
     self.updateGUIFromParameterNode()
 
+  def _removeParameterNodeObserver(self):
+    """
+    Remove the parameter node observer by its tag, if there is one.
+    """
+    if self._parameterNode is not None and self._pnObserverTag is not None:
+      self._parameterNode.RemoveObserver(self._pnObserverTag)
+    self._pnObserverTag = None
+
   def updateGUIFromParameterNode(self, caller=None, event=None):
     """
     This method is called whenever parameter node is changed.
@@ -181,9 +216,29 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     # Make sure GUI changes do not call updateParameterNodeFromGUI (it could cause infinite loop)
     self._updatingGUIFromParameterNode = True
-
-    # All the GUI updates are done
-    self._updatingGUIFromParameterNode = False
+    try:
+      # Only set widgets whose value differs from the parameter node, to avoid needless change signals
+      for selector, referenceRole in [
+          (self.ui.inputSelector, "InputVolume"),
+          (self.ui.outputSelector, "OutputVolume"),
+          (self.ui.invertedOutputSelector, "OutputVolumeInverse"),
+      ]:
+        nodeID = self._parameterNode.GetNodeReferenceID(referenceRole)
+        if (nodeID or "") != (selector.currentNodeID or ""):
+          selector.setCurrentNodeID(nodeID)
+
+      threshold = self._parameterNode.GetParameter("Threshold")
+      if threshold and self.ui.imageThresholdSliderWidget.value != float(threshold):
+        wasBlocked = self.ui.imageThresholdSliderWidget.blockSignals(True)
+        self.ui.imageThresholdSliderWidget.value = float(threshold)
+        self.ui.imageThresholdSliderWidget.blockSignals(wasBlocked)
+
+      invert = self._parameterNode.GetParameter("Invert")
+      if invert and self.ui.invertOutputCheckBox.checked != (invert == "true"):
+        self.ui.invertOutputCheckBox.checked = (invert == "true")
+    finally:
+      # All the GUI updates are done
+      self._updatingGUIFromParameterNode = False
 
   def updateParameterNodeFromGUI(self, caller=None, event=None):
     """
@@ -194,6 +249,25 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     if self._parameterNode is None or self._updatingGUIFromParameterNode:
       return
 
+    # Restart the timer, the parameter node is updated when there are no more changes
+    self._pnUpdateTimer.start()
+
+  def _flushParameterNodeUpdate(self):
+    """
+    Write pending GUI changes into the parameter node now instead of waiting for the timer.
+    """
+    if self._pnUpdateTimer.isActive():
+      self._pnUpdateTimer.stop()
+      self._commitParameterNode()
+
+  def _commitParameterNode(self):
+    """
+    Write the current GUI state into the parameter node.
+    """
+
+    if self._parameterNode is None:
+      return
+
     wasModified = self._parameterNode.StartModify()  # Modify all properties in a single batch
 
     self._parameterNode.SetNodeReferenceID("InputVolume", self.ui.inputSelector.currentNodeID)
@@ -229,51 +303,205 @@ class OnDemandWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
 
 class GoogleCloudPlatform(object):
+  """Runs gcloud commands for one project.
+  Methods that run gcloud raise RuntimeError if the command fails or its output cannot be parsed.
+  """
 
-  def __init__(self, project):
+  def __init__(self, project, executor):
+    """
+    The executor runs submit() jobs; it is owned by OnDemandLogic, which shuts it down.
+    """
     self.project = project
-
-  def gcloud(self, subcommand):
-    process = qt.QProcess()
-    process.start("gcloud", subcommand.split())
-    process.waitForFinished()
-    result = process.readAllStandardOutput().data().decode()
-    error = process.readAllStandardError().data().decode()
-    if process.exitStatus() != process.NormalExit:
-      print(f"gcloud error: {error}")
+    self.executor = executor
+    self._processes = set()
+    self._warnings = collections.deque()
+    self._tokenCache = {'token': None, 'expires': 0}
+    self._cache = {}
+
+  def gcloud(self, args):
+    """Run gcloud with the argument list args and return its standard output.
+    Raises RuntimeError with the gcloud error text if the command fails or gcloud cannot be started.
+    Messages that gcloud prints to stderr on success are queued for takeWarnings().
+    No Qt objects are used (not even print, which writes to the Python console), so this can run on the worker threads.
+    """
+    output = bytearray()
+    # stderr goes to a file so that a chatty stderr cannot block the process while stdout is being read
+    with tempfile.TemporaryFile() as errorFile:
+      try:
+        process = subprocess.Popen(["gcloud"] + args, stdout=subprocess.PIPE, stderr=errorFile)
+      except OSError as e:
+        raise RuntimeError(f"Could not run gcloud: {e}")
+      with process:
+        self._processes.add(process)
+        try:
+          for chunk in iter(lambda: process.stdout.read(65536), b""):
+            output.extend(chunk)
+        finally:
+          self._processes.discard(process)
+      errorFile.seek(0)
+      error = errorFile.read().decode()
+    if process.returncode != 0:
+      raise RuntimeError(f"gcloud error: {error}")
+    if error != "":
+      self._warnings.append(error)
+    return output.decode()
+
+  def takeWarnings(self):
+    """Return and clear the stderr messages of successful gcloud calls, oldest first."""
+    warnings = []
+    while self._warnings:
+      warnings.append(self._warnings.popleft())
+    return warnings
+
+  def submit(self, method, *args):
+    """Run method(*args) on the worker threads and return a Future for its result."""
+    return self.executor.submit(method, *args)
+
+  def terminate(self):
+    """Kill gcloud processes that are still running, so that their worker threads can finish."""
+    for process in list(self._processes):
+      process.kill()
+
+  def _cached(self, key, ttl, fn):
+    """Return fn() or the value stored under key if it is less than ttl seconds old.
+    Failed results (fn() raising or returning None) are not stored.
+    """
+    if key in self._cache:
+      value, timestamp = self._cache[key]
+      if time.time() - timestamp < ttl:
+        return value
+    value = fn()
+    if value is not None:
+      self._cache[key] = (value, time.time())
+    return value
+
+  def invalidate(self, key=None):
+    """Drop the cached result for key, or all cached results if key is None."""
+    if key is None:
+      self._cache.clear()
     else:
-      if error != "":
-        print(f"gcloud warning: {error}")
-    return result
+      self._cache.pop(key, None)
+
+  def gcloudList(self, args):
+    """Run a gcloud list command and return its rows as a list of dicts.
+    Raises RuntimeError if gcloud fails, so that a failure is not mistaken for an empty list.
+    """
+    import json
+    output = self.gcloud(args + ["--format=json"])
+    try:
+      return json.loads(output)
+    except ValueError as e:
+      raise RuntimeError(f"Unexpected gcloud output: {e}")
 
   def projects(self):
-    return self.gcloud("projects list").split("\n")[1:]
+    return self._cached("projects", 30, lambda: self.gcloudList(["projects", "list"]))
 
   def datasets(self):
-    return self.gcloud(f"--project {self.project} healthcare datasets list").split("\n")[1:]
+    return self._cached("datasets", 30, lambda: self.gcloudList(["--project", self.project, "healthcare", "datasets", "list"]))
 
   def dicomStores(self, dataset):
-    return self.gcloud(f"--project {self.project} healthcare dicom-stores list --dataset {dataset}").split("\n")[1:]
+    return self._cached(("dicomStores", dataset), 30, lambda: self.gcloudList(["--project", self.project, "healthcare", "dicom-stores", "list", "--dataset", dataset]))
 
   def instances(self):
-    return self.gcloud(f"--project {self.project} instances list").split("\n")[1:]
+    return self._cached("instances", 30, lambda: self.gcloudList(["--project", self.project, "compute", "instances", "list"]))
+
+  def inventory(self):
+    """Query projects, datasets and instances concurrently on the worker threads.
+    Returns immediately with a Future whose result is a dict with 'projects', 'datasets' and 'instances' keys.
+    The Future fails with the first error raised by any of the queries.
+    """
+    methods = {'projects': self.projects, 'datasets': self.datasets, 'instances': self.instances}
+    futures = {key: self.submit(method) for key, method in methods.items()}
+    inventoryFuture = Future()
+    lock = threading.Lock()
+    pending = set(futures)
+
+    def onQueryDone(key):
+      # Called on a worker thread; only the last query to finish resolves the inventory
+      with lock:
+        pending.discard(key)
+        if pending:
+          return
+      try:
+        inventoryFuture.set_result({key: future.result() for key, future in futures.items()})
+      except Exception as e:
+        inventoryFuture.set_exception(e)
+
+    for key, future in futures.items():
+      future.add_done_callback(lambda future, key=key: onQueryDone(key))
+    return inventoryFuture
 
   def createInstance(self, instanceID):
     image = "slicermachine-2021-06-16t16-04-21"
-    return self.gcloud(f"--project {self.project} compute instances create {instanceID} --machine-type=n1-standard-8 --accelerator=type=nvidia-tesla-k80,count=1 --image={image} --image-project=idc-sandbox-000 --boot-disk-size=200GB --boot-disk-type=pd-balanced --maintenance-policy=TERMINATE")
+    result = self.gcloud([
+        "--project", self.project, "compute", "instances", "create", instanceID,
+        "--machine-type=n1-standard-8",
+        "--accelerator=type=nvidia-tesla-k80,count=1",
+        f"--image={image}",
+        "--image-project=idc-sandbox-000",
+        "--boot-disk-size=200GB",
+        "--boot-disk-type=pd-balanced",
+        "--maintenance-policy=TERMINATE",
+    ])
+    self.invalidate("instances")
+    return result
 
   def instanceStatus(self, instanceID):
-    description = json.loads(self.gcloud(f"--project {self.project} compute instances describe --format json {instanceID}"))
-    return description['status']
+    import json
+    output = self.gcloud(["--project", self.project, "compute", "instances", "describe", "--format", "json", instanceID])
+    try:
+      return json.loads(output)['status']
+    except (KeyError, TypeError, ValueError) as e:
+      raise RuntimeError(f"Unexpected gcloud output: {e}")
+
+  def instanceStatuses(self, instanceIDs):
+    """Return a {name: status} dict for all instanceIDs using a single gcloud call."""
+    nameFilter = ",".join(instanceIDs)
+    descriptions = self.gcloudList(["--project", self.project, "compute", "instances", "list", f"--filter=name=({nameFilter})"])
+    return {description['name']: description['status'] for description in descriptions}
 
   def instanceSSHTunnel(self, instanceID, port):
     process = qt.QProcess()
-    subcommand = f"--project {self.project} compute ssh {instanceID} -- -L {port}:localhost:6080"
-    process.start("gcloud", subcommand.split())
+    process.start("gcloud", ["--project", self.project, "compute", "ssh", instanceID, "--", "-L", f"{port}:localhost:6080"])
     return process
 
+  @staticmethod
+  def parseTimestamp(text):
+    """Return the POSIX time of an ISO 8601 timestamp as printed by gcloud.
+    Fractional seconds and a Z or +hh:mm offset are optional; without an offset the time is taken as UTC.
+    Raises ValueError if text is not such a timestamp.
+    """
+    match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?", str(text).strip())
+    if match is None:
+      raise ValueError(f"Not a timestamp: {text}")
+    date, clock, fraction, offset = match.groups()
+    seconds = calendar.timegm(time.strptime(f"{date}T{clock}", "%Y-%m-%dT%H:%M:%S"))
+    if fraction:
+      seconds += float(fraction)
+    if offset and offset != "Z":
+      sign = -1 if offset[0] == "-" else 1
+      hours, minutes = int(offset[1:3]), int(offset[-2:])
+      seconds -= sign * (hours * 3600 + minutes * 60)
+    return seconds
+
   def token(self):
-    return self.gcloud("auth print-access-token").strip()
+    """Return an access token, reusing the cached one until 5 minutes before it expires."""
+    if time.time() < self._tokenCache['expires'] - 300:
+      return self._tokenCache['token']
+    import json
+    output = self.gcloud(["auth", "print-access-token", "--format=json"])
+    try:
+      description = json.loads(output)
+      token = description['token'].strip()
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+      raise RuntimeError(f"Unexpected gcloud output: {e}")
+    try:
+      expires = self.parseTimestamp(description['token_expiry'])
+    except (KeyError, ValueError):
+      # gcloud may hand out a token that expires soon, so without a known expiry do not cache it
+      return token
+    self._tokenCache = {'token': token, 'expires': expires}
+    return token
 
 
 #
@@ -295,18 +523,31 @@ class OnDemandLogic(ScriptedLoadableModuleLogic):
     Called when the logic class is instantiated. Can be used for initializing member variables.
     """
     ScriptedLoadableModuleLogic.__init__(self)
-    self.gcp = GoogleCloudPlatform("idc-sandbox-000")
+    self.executor = ThreadPoolExecutor(max_workers=4)
+    self.gcp = GoogleCloudPlatform("idc-sandbox-000", self.executor)
+
+  def shutdown(self):
+    """
+    Stop the worker threads without waiting for them.
+    Queued jobs are cancelled and running gcloud calls are killed, otherwise exiting the application
+    would wait for them (for example for a 'compute instances create' to complete).
+    """
+    self.executor.shutdown(wait=False, cancel_futures=True)
+    self.gcp.terminate()
 
   def setDefaultParameters(self, inputParameterNode):
     pass
 
   def launchSlicer(self, instanceID):
-    print(f"Launching {instanceID}...")
+    """Create the instance and return its ID. This blocks until gcloud is done, so run it on the worker threads."""
     self.gcp.createInstance(instanceID)
-    print(f"Launched {instanceID}")
+    return instanceID
 
 
 class OnDemandApp(object):
+  # Contents of .ui, .qss and image resources, shared by all app instances so each file is read only once
+  _resourceCache = {}
+
   def __init__(self):
     """
     Called when the logic class is instantiated. Can be used for initializing member variables.
@@ -315,24 +556,75 @@ class OnDemandApp(object):
 
     self.project = "idc-sandbox-000"
     self.logic = OnDemandLogic()
+    self._httpSession = None
+
+  def _loadUICached(self, path):
+    """Like slicer.util.loadUI, but the .ui file is read from disk only once.
+    A new widget is instantiated from the cached file contents on every call.
+    """
+    key = ('ui', path)
+    if key not in self._resourceCache:
+      f = qt.QFile(path)
+      if not f.open(qt.QFile.ReadOnly):
+        raise RuntimeError(f"Could not open UI file: {path}")
+      self._resourceCache[key] = f.readAll()
+      f.close()
+    buffer = qt.QBuffer()
+    buffer.setData(self._resourceCache[key])
+    buffer.open(qt.QIODevice.ReadOnly)
+    loader = qt.QUiLoader()
+    loader.setWorkingDirectory(qt.QFileInfo(path).dir())
+    widget = loader.load(buffer)
+    buffer.close()
+    if widget is None:
+      raise RuntimeError(f"Could not load UI file: {path}")
+    return widget
+
+  def _loadStyleSheetCached(self, path):
+    key = ('qss', path)
+    if key not in self._resourceCache:
+      f = qt.QFile(path)
+      if not f.open(qt.QFile.ReadOnly | qt.QFile.Text):
+        raise RuntimeError(f"Could not open style sheet: {path}")
+      styleText = qt.QTextStream(f)
+      self._resourceCache[key] = styleText.readAll()
+      f.close()
+    return self._resourceCache[key]
+
+  def _loadPixmapCached(self, path):
+    key = ('pixmap', path)
+    if key not in self._resourceCache:
+      pixmap = qt.QPixmap(path)
+      if pixmap.isNull():
+        raise RuntimeError(f"Could not load image: {path}")
+      self._resourceCache[key] = pixmap
+    return self._resourceCache[key]
 
   def main(self):
 
-    self.mainWindow = slicer.util.loadUI(slicer.modules.OnDemandWidget.resourcePath('UI/OnDemandMainWindow.ui'))
+    resourcePath = slicer.modules.OnDemandWidget.resourcePath
+    paths = {key: resourcePath(relativePath) for key, relativePath in {
+        'main': 'UI/OnDemandMainWindow.ui',
+        'qss': 'QSS/OnDemand.qss',
+        'logo': 'Icons/logo.png',
+        'rocket': 'UI/rocketButton.ui',
+        'robot': 'UI/robotButton.ui',
+        'tunnel': 'UI/tunnelButton.ui',
+        'success': 'UI/successButton.ui',
+    }.items()}
+
+    self.mainWindow = self._loadUICached(paths['main'])
 
-    f = qt.QFile(slicer.modules.OnDemandWidget.resourcePath('QSS/OnDemand.qss'))
-    f.open(qt.QFile.ReadOnly | qt.QFile.Text)
-    styleText = qt.QTextStream(f)
-    styleSheet = styleText.readAll()
+    styleSheet = self._loadStyleSheetCached(paths['qss'])
     self.mainWindow.setStyleSheet(styleSheet)
 
     self.ui = slicer.util.childWidgetVariables(self.mainWindow)
-    self.ui.logo.setPixmap(qt.QPixmap(slicer.modules.OnDemandWidget.resourcePath('Icons/logo.png')))
+    self.ui.logo.setPixmap(self._loadPixmapCached(paths['logo']))
 
-    self.ui.rocketButton = slicer.util.loadUI(slicer.modules.OnDemandWidget.resourcePath('UI/rocketButton.ui'))
-    self.ui.robotButton = slicer.util.loadUI(slicer.modules.OnDemandWidget.resourcePath('UI/robotButton.ui'))
-    self.ui.tunnelButton = slicer.util.loadUI(slicer.modules.OnDemandWidget.resourcePath('UI/tunnelButton.ui'))
-    self.ui.successButton = slicer.util.loadUI(slicer.modules.OnDemandWidget.resourcePath('UI/successButton.ui'))
+    self.ui.rocketButton = self._loadUICached(paths['rocket'])
+    self.ui.robotButton = self._loadUICached(paths['robot'])
+    self.ui.tunnelButton = self._loadUICached(paths['tunnel'])
+    self.ui.successButton = self._loadUICached(paths['success'])
 
     self.ui.instancesWidgetVerticalLayout.addWidget(self.ui.rocketButton)
     self.ui.instancesWidgetVerticalLayout.addWidget(self.ui.robotButton)
@@ -346,6 +638,7 @@ class OnDemandApp(object):
     self.ui.successButton.hide()
 
     self.ui.launchButton.connect("clicked()", self.requestLaunchAndConnect)
+    slicer.app.connect("aboutToQuit()", self.logic.shutdown)
     #self.ui.shutDownButton.connect("clicked()", self.disconnectAndDestroy)
 
     self.mainWindow.show()
@@ -353,7 +646,6 @@ class OnDemandApp(object):
   def updateStatus(self,message):
     print(message)
     self.ui.statusbar.showMessage(message)
-    slicer.app.processEvents()
 
   def onCreateInstance(self):
     self.ui.launchButton.hide()
@@ -380,42 +672,106 @@ class OnDemandApp(object):
     qt.QTimer.singleShot(100, self.launchAndConnect)
 
   def launchAndConnect(self):
-    startTime = time.time()
-    number = random.randint(1, 1000)
-    instanceID = f"sdp-slicer-on-demand-{number}"
-    self.logic.launchSlicer(instanceID)
-    launchSlicerTime = time.time()
+    import requests
+    if self._httpSession is None:
+      # One keep-alive connection is enough for the readiness probes, whichever tunnel port a launch uses
+      self._httpSession = requests.Session()
+      self._httpSession.mount("http://localhost:", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    self._startTime = time.time()
+    suffix = secrets.token_hex(4)
+    self._instanceID = f"sdp-slicer-on-demand-{suffix}"
+    self._port = 6081 + secrets.randbelow(1000)
+    print(f"Launching {self._instanceID}...")
+    future = self.logic.gcp.submit(self.logic.launchSlicer, self._instanceID)
+    self._whenDone(future, self._onInstanceCreated)
+
+  def _onInstanceCreated(self, instanceID):
+    if instanceID is None:
+      self.updateStatus(f"Failed to launch {self._instanceID}")
+      return
+    print(f"Launched {instanceID}")
+    self._launchSlicerTime = time.time()
     self.onLoopInstanceStatus()  # Change rocket button to robot button
-    waitTime = 0
-    while waitTime < 300:
-      waitTime += 1
-      status = self.logic.gcp.instanceStatus(instanceID)
-      if status not in ["PENDING", "STAGING"]:
-        break
-      else:
-        self.updateStatus(f"Status: {status} {waitTime}")
+    self._pollDelay = 1000
+    qt.QTimer.singleShot(self._nextPollDelay(), self._pollStatus)
+
+  def _nextPollDelay(self):
+    """Return the current poll delay and back off exponentially, capped at 30 seconds."""
+    delay = self._pollDelay
+    self._pollDelay = min(self._pollDelay * 2, 30000)
+    return delay
+
+  def _whenDone(self, future, callback):
+    """Call callback(future.result()) on the main thread once the worker thread has finished.
+    Qt objects must not be touched from the worker, so completion is checked from a main thread timer.
+    """
+    if not future.done():
+      qt.QTimer.singleShot(50, lambda: self._whenDone(future, callback))
+      return
+    for warning in self.logic.gcp.takeWarnings():
+      print(f"gcloud warning: {warning}")
+    try:
+      result = future.result()
+    except Exception as e:
+      print(f"Background task failed: {e}")
+      result = None
+    callback(result)
+
+  def _pollStatus(self):
+    future = self.logic.gcp.submit(self.logic.gcp.instanceStatuses, [self._instanceID])
+    self._whenDone(future, self._handleStatuses)
+
+  def _handleStatuses(self, statuses):
+    status = statuses.get(self._instanceID) if statuses else None
+    waitTime = time.time() - self._launchSlicerTime
+    if status is not None and status not in ["PENDING", "STAGING"]:
+      self._createTunnel()
+    elif waitTime < 300:
+      # Still starting, or the status could not be read this time
+      self.updateStatus(f"Status: {status or 'UNKNOWN'} {int(waitTime)}")
+      qt.QTimer.singleShot(self._nextPollDelay(), self._pollStatus)
+    elif status is None:
+      self.updateStatus(f"Could not get the status of {self._instanceID}")
+    else:
+      self._createTunnel()
+
+  def _createTunnel(self):
     self.onCreateTunnel()  # Change robot button to lock with key button
-    port = 6080 + number
-    self.sshProcess = self.logic.gcp.instanceSSHTunnel(instanceID, port)
-    instanceSSHTunnelTime = time.time()
-    rootUrl = f"http://localhost:{port}"
-    vncQUrl = qt.QUrl(f"{rootUrl}/vnc.html?autoconnect=true")
-    waitTime = 0
-    while waitTime < 300:
-      waitTime += 1
-      try:
-        reply = requests.get(rootUrl)
-        break
-      except requests.exceptions.ConnectionError:
-        pass
-      time.sleep(1)
-      self.updateStatus(f"Waiting for server ({waitTime})")
+    self.sshProcess = self.logic.gcp.instanceSSHTunnel(self._instanceID, self._port)
+    self._instanceSSHTunnelTime = time.time()
+    self._rootUrl = f"http://localhost:{self._port}"
+    self._pollDelay = 1000
+    qt.QTimer.singleShot(self._nextPollDelay(), self._pollServer)
+
+  def _probeServer(self):
+    """Return True if the VNC server answers. Runs on a worker thread, so it must not touch Qt objects."""
+    import requests
+    try:
+      self._httpSession.head(self._rootUrl, timeout=2, allow_redirects=False)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+      return False
+    return True
+
+  def _pollServer(self):
+    future = self.logic.gcp.submit(self._probeServer)
+    self._whenDone(future, self._handleServerProbe)
+
+  def _handleServerProbe(self, ready):
+    waitTime = time.time() - self._instanceSSHTunnelTime
+    if not ready and waitTime < 300:
+      self.updateStatus(f"Waiting for server ({int(waitTime)})")
+      qt.QTimer.singleShot(self._nextPollDelay(), self._pollServer)
+      return
+    self._onServerReady()
+
+  def _onServerReady(self):
     bootTime = time.time()
+    vncQUrl = qt.QUrl(f"{self._rootUrl}/vnc.html?autoconnect=true")
     qt.QDesktopServices.openUrl(vncQUrl)
-    print(f"launchSlicerTime = {launchSlicerTime - startTime}")
-    print(f"instanceSSHTunnelTime = {instanceSSHTunnelTime - launchSlicerTime}")
-    print(f"bootTime = {bootTime - instanceSSHTunnelTime}")
-    print(f"Total Time = {bootTime - startTime}")
+    print(f"launchSlicerTime = {self._launchSlicerTime - self._startTime}")
+    print(f"instanceSSHTunnelTime = {self._instanceSSHTunnelTime - self._launchSlicerTime}")
+    print(f"bootTime = {bootTime - self._instanceSSHTunnelTime}")
+    print(f"Total Time = {bootTime - self._startTime}")
     self.onInstanceRunning()  # Change lock with key button to shut down button
 
   def disconnectAndDestroy(self):
@@ -438,7 +794,24 @@ class OnDemandTest(ScriptedLoadableModuleTest):
     pass
 
   def runTest(self):
+    self.setUp()
+    self.test_ParseTimestamp()
+
     app = OnDemandApp()
     app.main()
     slicer.modules.app = app
 
+  def test_ParseTimestamp(self):
+    """ Token expiry times in the formats gcloud may print are all read as the same UTC time.
+    """
+    expected = calendar.timegm((2021, 6, 16, 16, 4, 21, 0, 0, 0))
+    parseTimestamp = GoogleCloudPlatform.parseTimestamp
+    self.assertEqual(parseTimestamp("2021-06-16T16:04:21Z"), expected)
+    self.assertAlmostEqual(parseTimestamp("2021-06-16T16:04:21.123456Z"), expected + 0.123456)
+    self.assertEqual(parseTimestamp("2021-06-16T16:04:21+00:00"), expected)
+    self.assertEqual(parseTimestamp("2021-06-16T18:04:21+02:00"), expected)
+    self.assertEqual(parseTimestamp("2021-06-16T11:04:21-0500"), expected)
+    self.assertEqual(parseTimestamp("2021-06-16T16:04:21"), expected)
+    self.assertEqual(parseTimestamp("2021-06-16 16:04:21"), expected)
+    with self.assertRaises(ValueError):
+      parseTimestamp("in one hour")